@@ -1,11 +1,16 @@
 from __future__ import print_function, with_statement
 import os
 import sys
+from math import floor, ceil, log10
 from abaqusConstants import *
 
 settings = {}   # Settings in memory
 jsonFileName = os.path.join(os.path.expanduser('~'), '.legendKing.json') # Settings file name
+backupFileName = jsonFileName + '.bak' # Previous settings during a Python 2 write
+jsonFileTime = None # Modification time of settings file when last read or written
+pluginDir = os.path.dirname(__file__)
 DEBUG = 'DEBUG' in os.environ
+powersOfTen = [10.0**e for e in range(23)] # exactly representable powers of ten
 
 
 def almostWhole(x, epsilon=1e-6):
@@ -16,8 +21,7 @@ def almostWhole(x, epsilon=1e-6):
     >>> almostWhole(30.01, 0.001)
     False
     """
-    rounded = round(x)
-    return (((rounded - epsilon) <= x) and ((rounded + epsilon) >= x))
+    return abs(x - round(x)) <= epsilon
 
 
 def significantDigits(x):
@@ -27,13 +31,19 @@ def significantDigits(x):
     2
     >>> significantDigits(30.0001)
     4
+    >>> significantDigits(9.214110289)
+    9
     """
     x = abs(x)
+    scaled = x
     digits = 0
     if x > 0:
-        while x < 0.99 or not almostWhole(x, 1e-6):
-            x *= 10
+        while scaled < 0.99 or not almostWhole(scaled, 1e-6):
             digits += 1
+            if digits < len(powersOfTen):
+                scaled = x*powersOfTen[digits] # single rounding, unlike repeated x *= 10
+            else:
+                scaled *= 10
     return digits
 
 
@@ -45,7 +55,6 @@ def linearScale(maxValue, minValue, guide=15):
     >>> linearScale(10055, 1)
     [1000.0, 2000.0, 3000.0, 4000.0, 5000.0, 6000.0, 7000.0, 8000.0, 9000.0, 10000.0]
     """
-    from math import floor, ceil, log10
     span = maxValue - minValue
     if span <= 0:
         raise ValueError('span is <= 0')
@@ -55,9 +64,12 @@ def linearScale(maxValue, minValue, guide=15):
         if span/(x*order) > guide:
             break # too many ticks would be needed
         delta = x*order
-    ticks = [ delta*int(ceil(minValue/delta)) ] # starting tick
-    while ticks[-1] < maxValue - 0.95*delta:
-        ticks.append(ticks[0] + len(ticks)*delta)
+    start = delta*int(ceil(minValue/delta)) # starting tick
+    limit = maxValue - 0.95*delta
+    count = max(0, int(floor((limit - start)/delta)))
+    while start + count*delta < limit: # correct for roundoff
+        count += 1
+    ticks = [start + i*delta for i in range(count + 1)]
     if abs(ticks[0]) < 0.05*delta: # fist tick is nearly 0
         ticks.pop(0) # let CAE show minimum value as first tick
     if abs(ticks[-1]) < 0.05*delta: # last tick is nearly 0
@@ -77,7 +89,6 @@ def logScale(maxValue, minValue, guide=15):
     >>> logScale(10055, 1)
     [1, 10, 100, 1000, 10000]
     """
-    from math import floor, ceil, log10
     if maxValue <= 0:
         # avoid math domain error
         maxOrder = 0
@@ -107,21 +118,28 @@ def tickFormat(ticks):
     >>> tickFormat([0, 5.5e-8, 11e-8])
     (SCIENTIFIC, 2)
     """
-    from math import floor, ceil, log10
     if len(ticks) < 2:
         raise ValueError('less than 2 ticks')
-    delta = min([ticks[i + 1] - ticks[i] for i in range(len(ticks) - 1)])
+    delta = min(b - a for a, b in zip(ticks, ticks[1:]))
     if delta <= 0:
         raise ValueError('nonpositive tick increment')
     numDecimal = -1 * ceil(log10(delta)) # approximate exponent of delta
     numDecimal += significantDigits(delta * 10**numDecimal)
 
-    minOrder = min([log10(abs(i)) for i in ticks if abs(i) > 0.1*delta])
-    maxOrder = max([log10(abs(i)) for i in ticks if abs(i) > 0.1*delta])
+    # Smallest and largest magnitudes in a single pass; ticks near zero
+    # are ignored for the minimum.
+    minTick = maxTick = 0
+    for tick in ticks:
+        tick = abs(tick)
+        if tick > maxTick:
+            maxTick = tick
+        if tick > 0.1*delta and (not minTick or tick < minTick):
+            minTick = tick
+    minOrder = log10(minTick)
+    maxOrder = log10(maxTick)
 
     if maxOrder > 5 or minOrder < -3: # very large or small
-        maxTick = max([abs(tick) for tick in ticks])
-        numDecimal += floor(log10(abs(maxTick))) # relative
+        numDecimal += floor(maxOrder) # relative
         numDecimal = min(max(numDecimal, 0), 9)
         return SCIENTIFIC, int(numDecimal)
 
@@ -151,116 +169,154 @@ def fieldName(viewport):
     return fromAbaqusString(' '.join((primaryVariable[0], primaryVariable[5])).strip())
 
 
-def setup_legend(viewport):
+def setup_legend(viewport, name=None):
     """Set the Abaqus/Viewer contour legend scale to even increments.
 
+    name is the fieldName(viewport) if the caller already knows it.
+
     Carl Osterwisch, 2006"""
 
     from abaqus import session
-    from math import log10
 
-    legendSettings = settings.get(fieldName(viewport), {})
+    if name is None:
+        name = fieldName(viewport)
+    legendSettings = settings.get(name, {})
     contourOptions = viewport.odbDisplay.contourOptions
     symbolOptions = viewport.odbDisplay.symbolOptions
     annotationOptions = viewport.viewportAnnotationOptions
 
-    spectrum = fromAbaqusString(legendSettings.get('spectrum', contourOptions.spectrum))
-    if spectrum and not spectrum in session.spectrums:
-        # spectrum is not yet defined in the session; try to recall saved version
-        spectrums = settings.get(' spectrums')
-        if spectrums and spectrum in spectrums: # spectrum exists in settings
-            session.Spectrum(name=toAbaqusString(spectrum),
-                colors=[toAbaqusString(color) for color in spectrums[spectrum]])
-        else:
-            spectrum = None # undefined in session and not available in settings
-
-    options = {
-            'outsideLimitsAboveColor': legendSettings.get('above'),
-            'outsideLimitsBelowColor': legendSettings.get('below'),
-            'spectrum': spectrum,
-        }
-    contourOptions.setValues(**{option:toAbaqusString(value)
-                for option, value in options.items() if value is not None})
-
-    # Save spectrum colors in case they are needed later
-    if spectrum:
-        settings[' spectrums'][spectrum] = session.spectrums[toAbaqusString(spectrum)].colors
-
-    if all(option in legendSettings for option in ('minValue', 'maxValue', 'guide')):
-        minValue = legendSettings['minValue']
-        maxValue = legendSettings['maxValue']
-        minExact = legendSettings.get('minExact')
-        maxExact = legendSettings.get('maxExact')
-        guide = legendSettings['guide']
-
-        if minValue > maxValue: # swap if necessary
-            minValue, maxValue = maxValue, minValue
-            minExact, maxExact = maxExact, minExact
-        elif minValue == maxValue:
-            raise ValueError('max scale == min scale')
-
-        if legendSettings.get('log'):
-            ticks = logScale(maxValue, minValue, guide)
-            contourOptions.setValues(intervalType=LOG)
-        else:
-            ticks = linearScale(maxValue, minValue, guide)
-            contourOptions.setValues(intervalType=UNIFORM)
-
-        contourOptions.setValues(
-                minValue = ticks[0], maxValue = ticks[-1],
-                minAutoCompute=OFF, maxAutoCompute=OFF,
-                numIntervals=len(ticks) - 1,
-                )
-        symbolOptions.setValues(
-                vectorMinValue = ticks[0],
-                vectorMaxValue = ticks[-1],
-                vectorMinValueAutoCompute=OFF, vectorMaxValueAutoCompute=OFF,
-                vectorIntervalNumber=len(ticks) - 1,
-                tensorMinValue = ticks[0],
-                tensorMaxValue = ticks[-1],
-                tensorMinValueAutoCompute=OFF, tensorMaxValueAutoCompute=OFF,
-                tensorIntervalNumber=len(ticks) - 1,
-                )
-        if minExact and minValue < ticks[0]:
-            ticks.insert(0, minValue)
-        if maxExact and maxValue > ticks[-1]:
-            ticks.append(maxValue)
-        if len(ticks) != contourOptions.numIntervals + 1:
-            contourOptions.setValues(
-                intervalType=USER_DEFINED,
-                intervalValues=ticks,
-                )
-        if legendSettings.get('log'):
-            fmt, decPlaces = SCIENTIFIC, 1
-        else:
-            fmt, decPlaces = tickFormat(ticks)
-        annotationOptions.setValues(
-                legendNumberFormat=fmt,
-                legendDecimalPlaces=decPlaces,
-                )
-        if DEBUG:
-            print(legendSettings.get('log', 'linear'),
-                  minValue, maxValue,
-                  minExact, maxExact)
-            print(ticks, fmt, decPlaces)
+    # Redraw once after all options are set
+    viewport.disableRefresh()
+    try:
+        spectrum = fromAbaqusString(legendSettings.get('spectrum', contourOptions.spectrum))
+        if spectrum and not spectrum in session.spectrums:
+            # spectrum is not yet defined in the session; try to recall saved version
+            spectrums = settings.get(' spectrums')
+            if spectrums and spectrum in spectrums: # spectrum exists in settings
+                session.Spectrum(name=toAbaqusString(spectrum),
+                    colors=[toAbaqusString(color) for color in spectrums[spectrum]])
+            else:
+                spectrum = None # undefined in session and not available in settings
+
+        options = {
+                'outsideLimitsAboveColor': legendSettings.get('above'),
+                'outsideLimitsBelowColor': legendSettings.get('below'),
+                'spectrum': spectrum,
+            }
+        contourValues = {option:toAbaqusString(value)
+                    for option, value in options.items() if value is not None}
+
+        # Save spectrum colors in case they are needed later
+        if spectrum:
+            settings[' spectrums'][spectrum] = session.spectrums[toAbaqusString(spectrum)].colors
+
+        # Calculate the scale before touching any options; the colors above
+        # are applied even if the scale settings are invalid.
+        ticks = None
+        try:
+            if all(option in legendSettings for option in ('minValue', 'maxValue', 'guide')):
+                minValue = legendSettings['minValue']
+                maxValue = legendSettings['maxValue']
+                minExact = legendSettings.get('minExact')
+                maxExact = legendSettings.get('maxExact')
+                guide = legendSettings['guide']
+
+                if minValue > maxValue: # swap if necessary
+                    minValue, maxValue = maxValue, minValue
+                    minExact, maxExact = maxExact, minExact
+                elif minValue == maxValue:
+                    raise ValueError('max scale == min scale')
+
+                if legendSettings.get('log'):
+                    scaleTicks = logScale(maxValue, minValue, guide)
+                    intervalType = LOG
+                else:
+                    scaleTicks = linearScale(maxValue, minValue, guide)
+                    intervalType = UNIFORM
+
+                exactTicks = list(scaleTicks)
+                if minExact and minValue < exactTicks[0]:
+                    exactTicks.insert(0, minValue)
+                if maxExact and maxValue > exactTicks[-1]:
+                    exactTicks.append(maxValue)
+                if legendSettings.get('log'):
+                    fmt, decPlaces = SCIENTIFIC, 1
+                else:
+                    fmt, decPlaces = tickFormat(exactTicks)
+                ticks = scaleTicks # scale is valid
+
+                contourValues.update(
+                        intervalType=intervalType,
+                        minValue = ticks[0], maxValue = ticks[-1],
+                        minAutoCompute=OFF, maxAutoCompute=OFF,
+                        numIntervals=len(ticks) - 1,
+                        )
+        finally:
+            contourOptions.setValues(**contourValues)
+
+        if ticks:
+            symbolOptions.setValues(
+                    vectorMinValue = ticks[0],
+                    vectorMaxValue = ticks[-1],
+                    vectorMinValueAutoCompute=OFF, vectorMaxValueAutoCompute=OFF,
+                    vectorIntervalNumber=len(ticks) - 1,
+                    tensorMinValue = ticks[0],
+                    tensorMaxValue = ticks[-1],
+                    tensorMinValueAutoCompute=OFF, tensorMaxValueAutoCompute=OFF,
+                    tensorIntervalNumber=len(ticks) - 1,
+                    )
+            # The kernel may adjust numIntervals, so compare with its value
+            if len(exactTicks) != contourOptions.numIntervals + 1:
+                contourOptions.setValues(
+                    intervalType=USER_DEFINED,
+                    intervalValues=exactTicks,
+                    )
+            annotationOptions.setValues(
+                    legendNumberFormat=fmt,
+                    legendDecimalPlaces=decPlaces,
+                    )
+            if DEBUG:
+                print(legendSettings.get('log', 'linear'),
+                      minValue, maxValue,
+                      minExact, maxExact)
+                print(exactTicks, fmt, decPlaces)
+    finally:
+        viewport.enableRefresh()
 
 
 def readSettings():
-    "Read settings file or create a new settings if necessary"
+    """Read settings file or create a new settings if necessary
+
+    The file is parsed again only if it was modified outside of this session.
+    """
     import json
-    if settings:
+    global jsonFileTime
+    if not os.path.exists(jsonFileName) and os.path.exists(backupFileName):
+        try:
+            os.rename(backupFileName, jsonFileName) # recover from interrupted write
+        except OSError as e:
+            if DEBUG:
+                print('readSettings', e)
+    try:
+        mtime = os.path.getmtime(jsonFileName)
+    except OSError:
+        mtime = None
+    if settings and mtime == jsonFileTime:
         return  # Already read
     try:
         with open(jsonFileName) as f:
-            settings.update(json.load(f))
+            newSettings = json.load(f)
+        settings.clear()
+        settings.update(newSettings)
     except Exception as e:
         if DEBUG:
             print('readSettings', e)
+    jsonFileTime = mtime
     meta = settings.setdefault(' meta', {})
     meta.setdefault('ignore', False) # used to disable memory of previous settings
     meta.update({
             'description': 'This file stores recently used settings according to field output',
-            'plugin': os.path.dirname(__file__),
+            'plugin': pluginDir,
         })
     spectrums = settings.setdefault(' spectrums', {}) # store custom spectrums
     spectrums.update({
@@ -271,15 +327,35 @@ def readSettings():
 
 
 def writeSettings():
-    "Save settings to disk"
+    """Save settings to disk
+
+    The file is written to a temporary name first so a crash cannot leave
+    it truncated. Python 2 cannot replace a file in one step, so there the
+    previous file is kept as a backup until the new one is in place.
+    """
     import json
-    if not settings.get(' meta', {}).get('ignore'):
-        try:
-            with open(jsonFileName, 'w') as f:
-                json.dump(settings, f, indent=2, sort_keys=True)
-        except Exception as e:
-            if DEBUG:
-                print('writeSettings', e)
+    global jsonFileTime
+    if settings.get(' meta', {}).get('ignore'):
+        return
+    tmpFileName = jsonFileName + '.tmp'
+    try:
+        with open(tmpFileName, 'w') as f:
+            json.dump(settings, f, indent=2, sort_keys=True)
+        if hasattr(os, 'replace'):
+            os.replace(tmpFileName, jsonFileName)
+        else:
+            # Python 2 cannot rename over an existing file on Windows
+            if os.path.exists(backupFileName):
+                os.remove(backupFileName)
+            if os.path.exists(jsonFileName):
+                os.rename(jsonFileName, backupFileName)
+            os.rename(tmpFileName, jsonFileName)
+            if os.path.exists(backupFileName):
+                os.remove(backupFileName)
+        jsonFileTime = os.path.getmtime(jsonFileName)
+    except Exception as e:
+        if DEBUG:
+            print('writeSettings', e)
 
 
 def setValues(vpName, maxValue, minValue, guide,
@@ -298,7 +374,7 @@ def setValues(vpName, maxValue, minValue, guide,
         return
     readSettings()  # make sure settings are loaded
     name = fieldName(viewport)
-    spectrum = viewport.odbDisplay.contourOptions.spectrum
+    contourOptions = viewport.odbDisplay.contourOptions
     settings[name] = {
             'maxValue': maxValue,
             'minValue': minValue,
@@ -306,12 +382,12 @@ def setValues(vpName, maxValue, minValue, guide,
             'maxExact': bool(maxExact),
             'minExact': bool(minExact),
             'log': log==LOG,
-            'spectrum': spectrum,
-            'above': viewport.odbDisplay.contourOptions.outsideLimitsAboveColor,
-            'below': viewport.odbDisplay.contourOptions.outsideLimitsBelowColor,
+            'spectrum': contourOptions.spectrum,
+            'above': contourOptions.outsideLimitsAboveColor,
+            'below': contourOptions.outsideLimitsBelowColor,
         }
 
-    setup_legend(viewport)
+    setup_legend(viewport, name)
     writeSettings()
 
 
@@ -335,11 +411,9 @@ def reverse_spectrum(vpName):
         return  # abort if no odb displayed
 
     contourOptions = viewport.odbDisplay.contourOptions
-    colors = list(reversed(session.spectrums[contourOptions.spectrum].colors))
+    colors = tuple(reversed(session.spectrums[contourOptions.spectrum].colors))
     for spectrum in session.spectrums.values():
-        if not len(spectrum.colors) == len(colors):
-            continue
-        if all(a == b for a, b in zip(colors, spectrum.colors)):
+        if tuple(spectrum.colors) == colors:
             break # found an existing match
     else:
         # New reversed spectrum must be created
@@ -355,7 +429,7 @@ def reverse_spectrum(vpName):
             'below': contourOptions.outsideLimitsAboveColor,
         }
     )
-    setup_legend(viewport)
+    setup_legend(viewport, name)
     writeSettings()
 
 
@@ -365,26 +439,32 @@ def restore_defaults(vpName):
     viewport = session.viewports[vpName]
     if not hasattr(viewport.odbDisplay, 'contourOptions'):
         return
-    default = session.defaultOdbDisplay.contourOptions
-    viewport.odbDisplay.contourOptions.setValues(
-            minAutoCompute=default.minAutoCompute,
-            maxAutoCompute=default.maxAutoCompute,
-            intervalType=default.intervalType,
-            numIntervals=default.numIntervals,
-            spectrum=default.spectrum,
-            outsideLimitsAboveColor=default.outsideLimitsAboveColor,
-            outsideLimitsBelowColor=default.outsideLimitsBelowColor)
-
-    default = session.defaultOdbDisplay.symbolOptions
-    viewport.odbDisplay.symbolOptions.setValues(
-            vectorMinValueAutoCompute=default.vectorMinValueAutoCompute,
-            vectorMaxValueAutoCompute=default.vectorMaxValueAutoCompute,
-            vectorIntervalNumber=default.vectorIntervalNumber,
-            vectorColorSpectrum=default.vectorColorSpectrum)
-
-    viewport.viewportAnnotationOptions.setValues(   # TODO: read actual default values
-            legendNumberFormat=SCIENTIFIC,  # Not compatible with versions < 6.7
-            legendDecimalPlaces=3)
+    contourOptions = viewport.odbDisplay.contourOptions
+    # Redraw once after all options are reset
+    viewport.disableRefresh()
+    try:
+        default = session.defaultOdbDisplay.contourOptions
+        contourOptions.setValues(
+                minAutoCompute=default.minAutoCompute,
+                maxAutoCompute=default.maxAutoCompute,
+                intervalType=default.intervalType,
+                numIntervals=default.numIntervals,
+                spectrum=default.spectrum,
+                outsideLimitsAboveColor=default.outsideLimitsAboveColor,
+                outsideLimitsBelowColor=default.outsideLimitsBelowColor)
+
+        default = session.defaultOdbDisplay.symbolOptions
+        viewport.odbDisplay.symbolOptions.setValues(
+                vectorMinValueAutoCompute=default.vectorMinValueAutoCompute,
+                vectorMaxValueAutoCompute=default.vectorMaxValueAutoCompute,
+                vectorIntervalNumber=default.vectorIntervalNumber,
+                vectorColorSpectrum=default.vectorColorSpectrum)
+
+        viewport.viewportAnnotationOptions.setValues(   # TODO: read actual default values
+                legendNumberFormat=SCIENTIFIC,  # Not compatible with versions < 6.7
+                legendDecimalPlaces=3)
+    finally:
+        viewport.enableRefresh()
 
 
 if __name__ == "__main__":
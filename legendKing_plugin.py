@@ -16,9 +16,14 @@ class myQuery:
         self.object = object
         self.subroutine = subroutine
         object.registerQuery(subroutine)
+    def close(self):
+        "unregister the query; safe to call more than once"
+        if self.object is not None:
+            self.object.unregisterQuery(self.subroutine)
+            self.object = None
     def __del__(self):
         "unregister the query when this object is deleted"
-        self.object.unregisterQuery(self.subroutine)
+        self.close()
     def __repr__(self):
         return 'myQuery {}'.format(self.subroutine.__doc__)
 
@@ -113,27 +118,31 @@ class scaleDB(AFXDataDialog):
 
     def hide(self):
         "Called to remove the dialog box"
-        self.variableQuery = None
-        self.sessionQuery = None
-        self.minmaxQuery = None
+        for queryName in ('variableQuery', 'sessionQuery', 'minmaxQuery'):
+            query = getattr(self, queryName, None)
+            if query:
+                query.close() # unregister now rather than relying on __del__
+            setattr(self, queryName, None)
         AFXDataDialog.hide(self)
 
     def onSessionChanged(self):
         "Recalculate settings based on a new session"
-        if session.currentViewportName == self.vpNameKw.getValue():
+        vpName = session.currentViewportName
+        if vpName == self.vpNameKw.getValue():
             return
         # If the current viewport changes then the contourQuery needs
         # to be updated.
-        viewport = session.viewports[session.currentViewportName]
-        self.vpNameKw.setValue(viewport.name)
+        viewport = session.viewports[vpName]
+        self.vpNameKw.setValue(vpName)
         if hasattr(viewport.displayedObject, 'steps'):
             # Seems to be an odb display
-            plotState = viewport.odbDisplay.display.plotState
-            self.odbDisplay = viewport.odbDisplay
-            self.contourOptions = viewport.odbDisplay.contourOptions
-            self.symbolOptions = viewport.odbDisplay.symbolOptions
+            odbDisplay = viewport.odbDisplay # fetch proxy once
+            plotState = odbDisplay.display.plotState
+            self.odbDisplay = odbDisplay
+            self.contourOptions = odbDisplay.contourOptions
+            self.symbolOptions = odbDisplay.symbolOptions
             self.primaryVariable = '' # force an update
-            self.variableQuery = myQuery(viewport.odbDisplay,
+            self.variableQuery = myQuery(odbDisplay,
                     self.onDisplayChanged)
             if SYMBOLS_ON_DEF in plotState or SYMBOLS_ON_UNDEF in plotState:
                 # Symbol plot
@@ -157,22 +166,24 @@ class scaleDB(AFXDataDialog):
 
     def onContourChanged(self):
         "Set GUI TextField to current min min"
+        if not self.min.getTarget():
+            return # Nothing to update
         minmax = (self.contourOptions.autoMinValue,
                 self.contourOptions.autoMaxValue)
         if minmax != self.minmax and isinstance(minmax[0], float):
-            if self.min.getTarget():
-                self.min.getTarget().setValue(minmax[0])
-                self.max.getTarget().setValue(minmax[1])
+            self.min.getTarget().setValue(minmax[0])
+            self.max.getTarget().setValue(minmax[1])
             self.minmax = minmax
 
     def onSymbolChanged(self):
         "Set GUI TextField to current min min"
+        if not self.min.getTarget():
+            return # Nothing to update
         minmax = (self.symbolOptions.autoVectorMinValue,
                 self.symbolOptions.autoVectorMaxValue)
         if minmax != self.minmax and isinstance(minmax[0], float):
-            if self.min.getTarget():
-                self.min.getTarget().setValue(minmax[0])
-                self.max.getTarget().setValue(minmax[1])
+            self.min.getTarget().setValue(minmax[0])
+            self.max.getTarget().setValue(minmax[1])
             self.minmax = minmax
 
     def onReverse(self, sender, sel, ptr):